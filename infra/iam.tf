@@ -50,7 +50,8 @@ resource "aws_iam_policy" "upload_app_policy" {
           "dynamodb:GetItem",
           "dynamodb:UpdateItem",
           "dynamodb:Query",
-          "dynamodb:Scan"
+          "dynamodb:Scan",
+          "dynamodb:DescribeTable"
         ],
         Resource = aws_dynamodb_table.metadata.arn
       },
@@ -33,6 +33,18 @@ resource "aws_s3_bucket_versioning" "file_storage_versioning" {
   }
 }
 
+# Allows browsers to PUT files directly via presigned URLs
+resource "aws_s3_bucket_cors_configuration" "file_storage_cors" {
+  bucket = aws_s3_bucket.file_storage.id
+
+  cors_rule {
+    allowed_headers = ["*"]
+    allowed_methods = ["PUT"]
+    allowed_origins = ["*"]
+    max_age_seconds = 3000
+  }
+}
+
 resource "aws_s3_bucket_public_access_block" "file_storage_public_access" {
   bucket = aws_s3_bucket.file_storage.id
 
@@ -6,6 +6,24 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def extract_insert(record):
+    """
+    Returns (user_id, file_path) for an INSERT record, or None if the record
+    lacks either attribute.
+
+    Specialized for the fixed NewImage schema (UserID and FilePath as "S").
+    """
+    try:
+        new_image = record['dynamodb']['NewImage']
+        user_id = new_image['UserID']['S']
+        file_path = new_image['FilePath']['S']
+    except (KeyError, TypeError):
+        return None
+    if not user_id or not file_path:
+        return None
+    return user_id, file_path
+
+
 def lambda_handler(event, context):
     """
     Processes DynamoDB Stream events passed from Step Functions.
@@ -13,63 +31,37 @@ def lambda_handler(event, context):
     This function expects an event that is a list of records from an
     EventBridge Pipe, which originates from a DynamoDB Stream.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
-
-    processed_records = []
-
-    # The event from the Pipe is a list of records
-    for record in event:
-        # Ensure the record has the expected structure
-        if 'dynamodb' not in record or 'NewImage' not in record['dynamodb']:
-            logger.warning(f"Skipping malformed record: {json.dumps(record)}")
-            continue
-
-        # Process only INSERT events
-        if record.get('eventName') == 'INSERT':
-            try:
-                new_image = record['dynamodb']['NewImage']
-
-                # Extract data from the DynamoDB JSON format
-                user_id = new_image.get('UserID', {}).get('S')
-                file_path = new_image.get('FilePath', {}).get('S')
-
-                if not user_id or not file_path:
-                    logger.warning(
-                        "Record is missing UserID or FilePath: "
-                        f"{json.dumps(new_image)}"
-                    )
-                    continue
+    logger.info("Received %d records.", len(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received event: %s", json.dumps(event))
 
-                # Prepare the data for the downstream system
-                downstream_payload = {
-                    'user_id': user_id,
-                    'file_path': file_path
-                }
+    # The event from the Pipe is a list of records.
+    # Drop non-INSERT events before touching NewImage.
+    inserts = [
+        record for record in event if record.get('eventName') == 'INSERT'
+    ]
+    processed_records = [
+        {'user_id': pair[0], 'file_path': pair[1]}
+        for pair in map(extract_insert, inserts)
+        if pair
+    ]
 
-                # In a real-world scenario, you would send this payload
-                # to another service. For this example, we'll just log it.
-                logger.info(
-                    "Processed data for downstream system: "
-                    f"{json.dumps(downstream_payload)}"
-                )
-                processed_records.append(downstream_payload)
+    malformed = len(inserts) - len(processed_records)
+    if malformed:
+        logger.warning(
+            "Skipped %d INSERT records missing UserID or FilePath.",
+            malformed
+        )
 
-            except Exception as e:
-                logger.error(f"Error processing record: {json.dumps(record)}")
-                logger.error(f"Exception: {e}")
-                # Depending on requirements, you might want to raise an
-                # exception to halt the Step Functions execution.
-                continue
+    # In a real-world scenario, you would send these records to another
+    # service. If that becomes a DynamoDB table, write them with
+    # table.batch_writer() rather than per-record put_item.
 
-    logger.info(f"Successfully processed {len(processed_records)} records.")
+    logger.info("Successfully processed %d records.", len(processed_records))
 
-    # Return a summary of processed data. This is useful for SFN output.
+    # Return only the count. Lambda serializes the return value itself, so the
+    # records are not JSON-encoded into a body string here.
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'message': (
-                f'Successfully processed {len(processed_records)} records.'
-            ),
-            'processed_data': processed_records
-        })
-    }
\ No newline at end of file
+        'count': len(processed_records),
+    }
@@ -1,13 +1,17 @@
 import datetime
 import os
-import json
 import logging
-from typing import Optional, Callable, Awaitable
+from typing import BinaryIO, Optional
 
 import boto3
+import orjson
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 
 # -----------------------------------------------------------------------------
@@ -15,8 +19,32 @@ from starlette.responses import Response
 # -----------------------------------------------------------------------------
 app = FastAPI()
 
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+# Shared client config so warm invocations keep reusing the same TLS connection
+boto_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=10,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+s3_client = boto3.client("s3", config=boto_config)
+# Presigned URLs must be SigV4 on the regional virtual-hosted endpoint: S3
+# rejects SigV2 for new buckets, and the global host can answer browsers with
+# a 307 redirect outside us-east-1, which fails the CORS preflight.
+s3_region = os.environ.get("AWS_REGION") or s3_client.meta.region_name
+s3_presign_client = boto3.client(
+    "s3",
+    region_name=s3_region,
+    endpoint_url=f"https://s3.{s3_region}.amazonaws.com",
+    config=Config(signature_version="s3v4", s3={"addressing_style": "virtual"}),
+)
+# Low-level client: skips loading the DynamoDB Resource layer at INIT
+dynamodb_client = boto3.client("dynamodb", config=boto_config)
+# Stream uploads to S3 in 8 MB parts instead of buffering the whole file
+transfer_config = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    use_threads=True,
+    max_concurrency=4,
+)
 logger = logging.getLogger("uvicorn")
 logger.setLevel("INFO")
 # -----------------------------------------------------------------------------
@@ -25,55 +53,163 @@ logger.setLevel("INFO")
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
 DYNAMODB_TABLE_NAME = os.environ.get("DYNAMODB_TABLE_NAME")
 DESTINATION_SYSTEM_ID = os.environ.get("DESTINATION_SYSTEM_ID", "A01")
+INITIALIZATION_TYPE = os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE", "on-demand")
 STAGE = "prod"
+PRESIGNED_URL_EXPIRES_IN = 900
 if not S3_BUCKET_NAME or not DYNAMODB_TABLE_NAME:
     raise RuntimeError("S3_BUCKET_NAME and DYNAMODB_TABLE_NAME must be set")
 
-table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+# Presigning is local (no request is sent), so fail INIT if the URL isn't usable
+_presign_check_url = s3_presign_client.generate_presigned_url(
+    "put_object", Params={"Bucket": S3_BUCKET_NAME, "Key": "presign-check"}
+)
+if (
+    "X-Amz-Algorithm=AWS4-HMAC-SHA256" not in _presign_check_url
+    or f"{S3_BUCKET_NAME}.s3.{s3_region}.amazonaws.com" not in _presign_check_url
+):
+    raise RuntimeError(f"Presigned URLs must be SigV4 on the regional S3 endpoint: {_presign_check_url}")
+
+# Metadata attributes that are the same for every upload (DynamoDB JSON format)
+CONSTANT_ITEM_ATTRIBUTES = {
+    "DownloadCount": {"N": "0"},
+    "DestinationSystemID": {"S": DESTINATION_SYSTEM_ID},
+    "IsDeleted": {"BOOL": False},
+}
+
+
+def _warm_up_clients() -> None:
+    """
+    Resolves credentials/endpoints and opens the TLS connections during INIT,
+    so the first request does not pay for them.
+    """
+    try:
+        dynamodb_client.describe_table(TableName=DYNAMODB_TABLE_NAME)
+        s3_client.head_bucket(Bucket=S3_BUCKET_NAME)
+    except Exception as e:
+        logger.warning(f"Client warm-up failed: {e}")
+
+
+# Only warm up when INIT runs ahead of traffic (provisioned concurrency);
+# on-demand cold starts would just pay for it up front. SnapStart doesn't
+# apply: FileUploadFunction is an Image package, and connections opened
+# before a snapshot would be stale after restore anyway.
+if INITIALIZATION_TYPE == "provisioned-concurrency":
+    _warm_up_clients()
 
 
 # Logging Middleware
-# class CustomLoggingMiddleware(BaseHTTPMiddleware):
-#     async def dispatch(self, request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-#         log_data = {
-#             "method": request.method,
-#             "url": str(request.url),
-#             "headers": dict(request.headers),
-#         }
-
-#         content_type = request.headers.get("content-type", "")
-#         if request.method == "POST":
-#             try:
-#                 if "application/json" in content_type:
-#                     log_data["body"] = await request.json()
-#                 elif "multipart/form-data" in content_type:
-#                     form = await request.form()
-#                     log_data["form"] = {}
-#                     for key, value in form.items():
-#                         if hasattr(value, "filename"):
-#                             log_data["form"][key] = {
-#                                 "filename": value.filename,
-#                                 "content_type": value.content_type,
-#                                 "size": len(await value.read())
-#                             }
-#                         else:
-#                             log_data["form"][key] = value
-#             except Exception as e:
-#                 log_data["error"] = f"Failed to parse body: {e}"
-#         message = json.dumps(log_data, ensure_ascii=False)
-#         logger.info(f"request: {message}")
-#         response = await call_next(request)
-#         return response
-
-
-# # Middleware registration
-# app.add_middleware(CustomLoggingMiddleware)
+class CustomLoggingMiddleware:
+    """
+    Pure ASGI middleware that logs request metadata from the headers only.
+    The body is never read, so uploads are not buffered or drained here.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            log_data = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "content_type": headers.get("content-type"),
+                "content_length": headers.get("content-length"),
+            }
+            logger.info("request: %s", orjson.dumps(log_data).decode())
+        await self.app(scope, receive, send)
+
+
+# Middleware registration
+app.add_middleware(CustomLoggingMiddleware)
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+def get_user_id(request: Request) -> str:
+    """
+    Extracts the Cognito user ID (sub) from the API Gateway request context.
+    """
+    raw_context = request.headers.get("x-amzn-request-context")
+    logger.info(f"x-amzn-request-context: {raw_context}")
+    if not raw_context:
+        raise HTTPException(status_code=403, detail="Could not validate user from token.")
+
+    try:
+        user_id = orjson.loads(raw_context)["authorizer"]["claims"]["sub"]
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=500, detail="JSON parse error in authorizer.")
+    except (KeyError, TypeError):
+        user_id = None
+    if not user_id:
+        raise HTTPException(status_code=403, detail="User ID not found in token claims.")
+    return user_id
+
+
+def build_file_path(user_id: str, file_name: str, now: datetime.datetime) -> str:
+    """
+    Builds the S3 key for an uploaded file.
+    """
+    if not file_name or "/" in file_name:
+        raise HTTPException(status_code=400, detail="Invalid file name.")
+    current_time = f"{now:%Y%m%d%H%M%S}{now.microsecond // 1000:03d}"
+    return f"{DESTINATION_SYSTEM_ID}/{user_id}/{current_time}/{file_name}"
+
+
+def upload_to_s3(fileobj: BinaryIO, file_path: str) -> None:
+    """
+    Streams the file object to S3.
+    """
+    try:
+        s3_client.upload_fileobj(
+            fileobj, S3_BUCKET_NAME, file_path, Config=transfer_config
+        )
+    except Exception as e:
+        logging.error(f"S3 upload failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to upload file to S3: {e}")
+
+
+def register_metadata(
+    file_path: str,
+    user_id: str,
+    comment: Optional[str],
+    now: datetime.datetime,
+    if_not_exists: bool = False,
+) -> None:
+    """
+    Records the uploaded file's metadata in DynamoDB.
+    With if_not_exists, an existing item for the path is left untouched (409).
+    """
+    condition = {"ConditionExpression": "attribute_not_exists(FilePath)"} if if_not_exists else {}
+    try:
+        # Item is written directly in DynamoDB JSON format
+        item_to_register = {
+            **CONSTANT_ITEM_ATTRIBUTES,
+            "FilePath": {"S": file_path},
+            "UserID": {"S": user_id},
+            "Comment": {"S": comment or ""},
+            "RegistrationDate": {"S": now.isoformat()},
+        }
+        dynamodb_client.put_item(
+            TableName=DYNAMODB_TABLE_NAME, Item=item_to_register, **condition
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise HTTPException(status_code=409, detail="File is already registered.")
+        logging.error(f"DynamoDB put_item failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to register metadata in DynamoDB: {e}")
+    except Exception as e:
+        logging.error(f"DynamoDB put_item failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to register metadata in DynamoDB: {e}")
+
 
 # -----------------------------------------------------------------------------
 # API Endpoint for File Upload
 # -----------------------------------------------------------------------------
+# Endpoints that call AWS are plain `def`: boto3 is blocking, and FastAPI runs
+# sync endpoints in its threadpool instead of on the event loop.
 @app.post("/{}/upload".format(STAGE))
-async def upload_file(
+def upload_file(
     request: Request,
     file: UploadFile = File(...),
     comment: Optional[str] = Form(None),
@@ -82,57 +218,93 @@ async def upload_file(
     Handles file upload using multipart/form-data, saves file to S3,
     and records metadata in DynamoDB.
     """
-    try:
-        raw_context = request.headers.get("x-amzn-request-context")
-        logger.info(f"x-amzn-request-context: {raw_context}")
-        claims = {}
-        if raw_context:
-            try:
-                context = json.loads(raw_context)
-                claims = context.get("authorizer", {}).get("claims", {})
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail="JSON parse error in authorizer.")
-
-            user_id = claims.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=403, detail="User ID not found in token claims.")
-    except Exception:
-        raise HTTPException(status_code=403, detail="Could not validate user from token.")
+    user_id = get_user_id(request)
 
-    file_content = await file.read()
-    if not file_content:
+    if not file.size:
         raise HTTPException(status_code=400, detail="File content is empty.")
 
-    current_time = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")[:-3]
+    # One timestamp for both the S3 key and RegistrationDate
+    now = datetime.datetime.now(datetime.timezone.utc)
     # Use the original filename from the upload
-    file_path = os.path.join(
-        DESTINATION_SYSTEM_ID, user_id, current_time, file.filename
-    )
+    file_path = build_file_path(user_id, file.filename, now)
 
     # --- 1. Upload to S3 ---
+    # Must finish before the DynamoDB INSERT: the stream event it produces
+    # tells downstream the file is present.
+    file.file.seek(0)
+    upload_to_s3(file.file, file_path)
+
+    # --- 2. Register metadata in DynamoDB ---
+    # A failure here leaves an orphan object but no stream event. Don't delete
+    # it: after a timeout the INSERT may already have been committed.
+    register_metadata(file_path, user_id, comment, now)
+
+    return {"message": "File uploaded successfully.", "s3_path": file_path}
+
+
+# -----------------------------------------------------------------------------
+# API Endpoints for Direct-to-S3 Upload (presigned URL)
+# -----------------------------------------------------------------------------
+class UploadUrlRequest(BaseModel):
+    file_name: str
+
+
+class RegisterRequest(BaseModel):
+    s3_path: str
+    comment: Optional[str] = None
+
+
+@app.post("/{}/upload-url".format(STAGE))
+def create_upload_url(request: Request, request_data: UploadUrlRequest):
+    """
+    Issues a presigned S3 PUT URL so the client can upload the file body
+    directly to S3. Call /register with the returned s3_path afterwards.
+    """
+    user_id = get_user_id(request)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    file_path = build_file_path(user_id, request_data.file_name, now)
     try:
-        s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=file_path, Body=file_content)
+        upload_url = s3_presign_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": S3_BUCKET_NAME, "Key": file_path},
+            ExpiresIn=PRESIGNED_URL_EXPIRES_IN,
+        )
     except Exception as e:
-        logging.error(f"S3 upload failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to upload file to S3: {e}")
+        logging.error(f"Presigned URL generation failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to create upload URL: {e}")
+
+    return {"upload_url": upload_url, "s3_path": file_path}
+
+
+@app.post("/{}/register".format(STAGE))
+def register_file(request: Request, request_data: RegisterRequest):
+    """
+    Records metadata in DynamoDB for a file uploaded via a presigned URL.
+    """
+    user_id = get_user_id(request)
+
+    file_path = request_data.s3_path
+    if not file_path.startswith(f"{DESTINATION_SYSTEM_ID}/{user_id}/"):
+        raise HTTPException(status_code=403, detail="S3 path does not belong to the user.")
 
-    # --- 2. Register metadata in DynamoDB ---
     try:
-        item_to_register = {
-            "FilePath": file_path,
-            "UserID": user_id,
-            "Comment": comment or "",
-            "RegistrationDate": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-            "DownloadCount": 0,
-            "DestinationSystemID": DESTINATION_SYSTEM_ID,
-            "IsDeleted": False,
-        }
-        table.put_item(Item=item_to_register)
+        head = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            raise HTTPException(status_code=404, detail="Uploaded file not found in S3.")
+        logging.error(f"S3 head_object failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to check uploaded file in S3: {e}")
     except Exception as e:
-        logging.error(f"DynamoDB put_item failed: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to register metadata in DynamoDB: {e}")
+        logging.error(f"S3 head_object failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to check uploaded file in S3: {e}")
+    if not head.get("ContentLength"):
+        raise HTTPException(status_code=400, detail="File content is empty.")
 
-    return {"message": "File uploaded successfully.", "s3_path": file_path}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    register_metadata(file_path, user_id, request_data.comment, now, if_not_exists=True)
+
+    return {"message": "File registered successfully.", "s3_path": file_path}
 
 
 # -----------------------------------------------------------------------------